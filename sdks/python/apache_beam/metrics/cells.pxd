@@ -0,0 +1,59 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+cimport cython
+
+
+cdef class CellCommitState(object):
+  cdef public object _lock
+  cdef public object _state
+  cpdef after_modification(self)
+  cpdef after_commit(self)
+  cpdef bint before_commit(self)
+  # Pads the object past a 64-byte cache line. Cells belonging to different
+  # metrics are updated concurrently from different worker threads; without
+  # padding, several of these small objects can share one cache line and
+  # every dirty-bit store invalidates the others' line (false sharing). Only
+  # affects the compiled build, at a cost of 64 bytes per instance.
+  cdef char _padding[64]
+
+
+cdef class MetricCell(object):
+  cdef public CellCommitState commit
+  cdef public object _lock
+  # See CellCommitState._padding.
+  cdef char _padding[64]
+
+
+cdef class CounterCell(MetricCell):
+  cdef public object _count
+  cdef public object _count_reads
+  cdef public object _adjust_shards
+  cpdef inc(self, n=*)
+  cpdef inc_by(self, n)
+
+
+cdef class DistributionCell(MetricCell):
+  cdef public DistributionData data
+  cpdef update(self, value)
+
+
+cdef class DistributionData(object):
+  cdef public object sum
+  cdef public object count
+  cdef public object min
+  cdef public object max
@@ -24,10 +24,17 @@ Cells depend on a 'dirty-bit' in the CellCommitState class that tracks whether
 a cell's updates have been committed.
 """
 
-import threading
+import itertools
+from thread import allocate_lock
+from thread import get_ident
 
-from apache_beam.metrics.metricbase import Counter
-from apache_beam.metrics.metricbase import Distribution
+# Sentinel min/max values of an empty distribution. Any reported value
+# compares smaller (resp. larger), so the update and combine paths need no
+# "unset" checks. Distributions are restricted to int64 values, hence
+# INT64_MAX/INT64_MIN. They are converted back to None when results are
+# materialized for users.
+_UNSET_MIN = 2**63 - 1
+_UNSET_MAX = -2**63
 
 
 class CellCommitState(object):
@@ -40,8 +47,15 @@ class CellCommitState(object):
   The tracking of a cell's state is done conservatively: A metric may be
   reported DIRTY even if updates have not occurred.
 
-  This class is thread-safe.
+  This class is thread-safe. Its hot path is lock-free: marking an
+  already-dirty cell dirty again is a single load of ``_state``, atomic in
+  CPython as it executes under the GIL, and between commits every update
+  after the first takes that path. The lock is only held for actual state
+  transitions - by the commit side, and by the first update after a commit -
+  so that a dirty bit stored concurrently with ``after_commit`` can never be
+  overwritten with CLEAN and lost.
   """
+  __slots__ = ('_lock', '_state')
 
   # Indicates that there have been changes to the cell since the last commit.
   DIRTY = 0
@@ -55,21 +69,27 @@ class CellCommitState(object):
 
     A cell is initialized as dirty.
     """
-    self._lock = threading.Lock()
+    self._lock = allocate_lock()
     self._state = CellCommitState.DIRTY
 
   @property
   def state(self):
-    with self._lock:
-      return self._state
+    return self._state
 
   def after_modification(self):
     """Indicate that changes have been made to the metric being tracked.
 
     Should be called after modification of the metric value.
+
+    Between commits all calls after the first find the cell already dirty
+    and return after a single load, without touching the lock. Only the
+    first update after a commit takes the lock to store the dirty bit,
+    which keeps the store from racing with the check-then-store in
+    ``after_commit``.
     """
-    with self._lock:
-      self._state = CellCommitState.DIRTY
+    if self._state != CellCommitState.DIRTY:
+      with self._lock:
+        self._state = CellCommitState.DIRTY
 
   def after_commit(self):
     """Mark changes made up to the last call to ``before_commit`` as committed.
@@ -91,9 +111,17 @@ class CellCommitState(object):
 
     After a commit is successful, ``after_commit`` should be called.
 
+    A concurrent updater may observe the cell already DIRTY and skip its
+    own dirty store without taking the lock. This is safe: cells always
+    mutate their value before checking the dirty bit, so a skipped store
+    refers to changes that the in-progress commit will observe when it
+    reads the value.
+
     Returns:
       A boolean, which is false if the cell is CLEAN, and true otherwise.
     """
+    if self._state == CellCommitState.CLEAN:
+      return False
     with self._lock:
       if self._state == CellCommitState.CLEAN:
         return False
@@ -108,27 +136,58 @@ class MetricCell(object):
   All subclasses must be thread safe, as these are used in the pipeline runners,
   and may be subject to parallel/concurrent updates. Cells should only be used
   directly within a runner.
+
+  Cells use __slots__: runners create one cell per metric per bundle, so the
+  saved per-instance __dict__ and the faster slot-descriptor attribute access
+  add up on the update path.
   """
+  __slots__ = ('commit', '_lock')
+
   def __init__(self):
     self.commit = CellCommitState()
-    self._lock = threading.Lock()
+    # In CPython 2, threading.Lock is an alias for this C primitive; calling
+    # the allocator directly just skips the threading module indirection when
+    # constructing cells, which happens once per metric per bundle.
+    self._lock = allocate_lock()
 
   def get_cumulative(self):
     raise NotImplementedError
 
 
-class CounterCell(Counter, MetricCell):
+class CounterCell(MetricCell):
   """Tracks the current value and delta of a counter metric.
 
   Each cell tracks the state of a metric independently per context per bundle.
   Therefore, each metric has a different cell in each bundle, cells are
   aggregated by the runner.
 
-  This class is thread safe.
+  This class is thread safe. Updates do not take a lock: single increments
+  are tracked with an ``itertools.count`` iterator, which CPython advances
+  with one C call that is atomic under the GIL, and other amounts accumulate
+  in per-thread shards. Only snapshot reads synchronize through the cell
+  lock, and they happen at commit time.
   """
-  def __init__(self, *args):
-    super(CounterCell, self).__init__(*args)
-    self.value = 0
+  __slots__ = ('_count', '_count_reads', '_adjust_shards')
+
+  def __init__(self):
+    # MetricCell.__init__ is inlined (instead of called through super) to
+    # save the dispatch overhead; cells are constructed once per metric per
+    # bundle, which adds up in pipelines with many short bundles.
+    self.commit = CellCommitState()
+    self._lock = allocate_lock()
+    # Number of inc(1) calls. Calling next() on it is atomic under the GIL,
+    # but also consumes a tick, so snapshot reads are accounted for in
+    # _count_reads (protected by the cell lock).
+    self._count = itertools.count()
+    self._count_reads = 0
+    # Increments by amounts other than 1, sharded by thread ident. Each
+    # thread only ever writes its own entry, so updates need no lock; dict
+    # operations themselves are atomic under the GIL.
+    self._adjust_shards = {}
+
+  @property
+  def value(self):
+    return self.get_cumulative()
 
   def combine(self, other):
     result = CounterCell()
@@ -136,16 +195,46 @@ class CounterCell(Counter, MetricCell):
     return result
 
   def inc(self, n=1):
-    with self._lock:
-      self.value += n
-      self.commit.after_modification()
+    if n == 1:
+      # Hot path: the overwhelmingly common call shape is a bare inc().
+      next(self._count)
+      # Inlined self.commit.after_modification() to avoid a method call on
+      # the hot path: a single GIL-atomic load when the cell is already
+      # dirty, which is the case for every increment but the first since
+      # the last commit; the dirty store itself takes the commit lock so it
+      # cannot race with after_commit's transition to CLEAN.
+      commit = self.commit
+      if commit._state != CellCommitState.DIRTY:
+        with commit._lock:
+          commit._state = CellCommitState.DIRTY
+    else:
+      self.inc_by(n)
+
+  def inc_by(self, n):
+    """Increment the counter by an arbitrary amount.
+
+    Cold path of ``inc``: amounts other than 1 accumulate in a per-thread
+    shard, so concurrent callers do not contend on a lock.
+    """
+    shards = self._adjust_shards
+    tid = get_ident()
+    shards[tid] = shards.get(tid, 0) + n
+    commit = self.commit
+    if commit._state != CellCommitState.DIRTY:
+      with commit._lock:
+        commit._state = CellCommitState.DIRTY
+
+  def dec(self, n=1):
+    self.inc_by(-n)
 
   def get_cumulative(self):
     with self._lock:
-      return self.value
+      ticks = next(self._count) - self._count_reads
+      self._count_reads += 1
+      return ticks + sum(self._adjust_shards.values())
 
 
-class DistributionCell(Distribution, MetricCell):
+class DistributionCell(MetricCell):
   """Tracks the current value and delta for a distribution metric.
 
   Each cell tracks the state of a metric independently per context per bundle.
@@ -154,8 +243,12 @@ class DistributionCell(Distribution, MetricCell):
 
   This class is thread safe.
   """
-  def __init__(self, *args):
-    super(DistributionCell, self).__init__(*args)
+  __slots__ = ('data',)
+
+  def __init__(self):
+    # Inlined MetricCell.__init__, as in CounterCell.
+    self.commit = CellCommitState()
+    self._lock = allocate_lock()
     self.data = DistributionData(0, 0, None, None)
 
   def combine(self, other):
@@ -165,19 +258,53 @@ class DistributionCell(Distribution, MetricCell):
 
   def update(self, value):
     with self._lock:
-      self.commit.after_modification()
       self._update(value)
+      # Inlined self.commit.after_modification(), as in CounterCell.inc.
+      commit = self.commit
+      if commit._state != CellCommitState.DIRTY:
+        with commit._lock:
+          commit._state = CellCommitState.DIRTY
+
+  def update_many(self, values):
+    """Report several values to the distribution in a single batch.
+
+    This is equivalent to calling ``update`` once per element of ``values``,
+    but takes the cell lock and marks the cell dirty only once, amortizing
+    the per-sample synchronization cost over the whole batch.
+    """
+    values = [int(value) for value in values]
+    if not values:
+      return
+    total = sum(values)
+    lo = min(values)
+    hi = max(values)
+    with self._lock:
+      data = self.data
+      data.count += len(values)
+      data.sum += total
+      if lo < data.min:
+        data.min = lo
+      if hi > data.max:
+        data.max = hi
+      commit = self.commit
+      if commit._state != CellCommitState.DIRTY:
+        with commit._lock:
+          commit._state = CellCommitState.DIRTY
 
   def _update(self, value):
-    value = int(value)
-    self.data.count += 1
-    self.data.sum += value
-    self.data.min = (value
-                     if self.data.min is None or self.data.min > value
-                     else self.data.min)
-    self.data.max = (value
-                     if self.data.max is None or self.data.max < value
-                     else self.data.max)
+    # This runs under the cell lock for every reported sample, so it is kept
+    # as a minimal kernel: self.data is loaded once, and min/max are only
+    # stored when they actually change. Samples are almost always plain
+    # ints already, so the int() coercion is only paid for other types.
+    if value.__class__ is not int:
+      value = int(value)
+    data = self.data
+    data.count += 1
+    data.sum += value
+    if value < data.min:
+      data.min = value
+    if value > data.max:
+      data.max = value
 
   def get_cumulative(self):
     with self._lock:
@@ -187,8 +314,13 @@ class DistributionCell(Distribution, MetricCell):
 class DistributionResult(object):
   """The result of a Distribution metric.
   """
+  __slots__ = ('data', '_mean')
+
   def __init__(self, data):
     self.data = data
+    # Results wrap a snapshot of the distribution data, so the mean can be
+    # computed once instead of on every access.
+    self._mean = None if data.count == 0 else float(data.sum) / data.count
 
   def __eq__(self, other):
     return self.data == other.data
@@ -202,11 +334,13 @@ class DistributionResult(object):
 
   @property
   def max(self):
-    return self.data.max
+    """Returns the max of the distribution, or None if it has no elements."""
+    return self.data.max if self.data.count else None
 
   @property
   def min(self):
-    return self.data.min
+    """Returns the min of the distribution, or None if it has no elements."""
+    return self.data.min if self.data.count else None
 
   @property
   def count(self):
@@ -222,9 +356,7 @@ class DistributionResult(object):
 
     If the distribution contains no elements, it returns None.
     """
-    if self.data.count == 0:
-      return None
-    return float(self.data.sum)/self.data.count
+    return self._mean
 
 
 class DistributionData(object):
@@ -234,28 +366,34 @@ class DistributionData(object):
 
   This object is not thread safe, so it's not supposed to be modified
   by other than the DistributionCell that contains it.
+
+  Internally, the min/max of an empty distribution are tracked with int64
+  sentinel values rather than None, so that updates and combines need no
+  "unset" checks. ``None`` min/max arguments are accepted for backwards
+  compatibility and normalized to the sentinels.
   """
+  __slots__ = ('sum', 'count', 'min', 'max')
+
   def __init__(self, sum, count, min, max):
     self.sum = sum
     self.count = count
-    self.min = min
-    self.max = max
+    self.min = _UNSET_MIN if min is None else min
+    self.max = _UNSET_MAX if max is None else max
+
+  def _tup(self):
+    return (self.sum, self.count, self.min, self.max)
 
   def __eq__(self, other):
-    return (self.sum == other.sum and
-            self.count == other.count and
-            self.min == other.min and
-            self.max == other.max)
+    # Comparing the field tuples runs as a single C-level comparison instead
+    # of four interpreted ones; aggregation and test loops compare these
+    # objects frequently.
+    return self._tup() == other._tup()
 
   def __neq__(self, other):
     return not self.__eq__(other)
 
   def __repr__(self):
-    return '<DistributionData(sum={}, count={}, min={}, max={})>'.format(
-        self.sum,
-        self.count,
-        self.min,
-        self.max)
+    return '<DistributionData(sum=%s, count=%s, min=%s, max=%s)>' % self._tup()
 
   def get_cumulative(self):
     return DistributionData(self.sum, self.count, self.min, self.max)
@@ -264,15 +402,11 @@ class DistributionData(object):
     if other is None:
       return self
 
-    new_min = (None if self.min is None and other.min is None else
-               min(x for x in (self.min, other.min) if x is not None))
-    new_max = (None if self.max is None and other.max is None else
-               max(x for x in (self.max, other.max) if x is not None))
     return DistributionData(
         self.sum + other.sum,
         self.count + other.count,
-        new_min,
-        new_max)
+        self.min if self.min < other.min else other.min,
+        self.max if self.max > other.max else other.max)
 
   @classmethod
   def singleton(cls, value):
@@ -287,6 +421,17 @@ class MetricAggregator(object):
   def combine(self, updates):
     raise NotImplementedError
 
+  def combine_many(self, updates):
+    """Combine an iterable of updates into a single value.
+
+    Equivalent to reducing the updates pairwise with ``combine``, but
+    subclasses can override it to aggregate the whole batch in one pass.
+    """
+    result = self.zero()
+    for update in updates:
+      result = self.combine(result, update)
+    return result
+
   def result(self, x):
     raise NotImplementedError
 
@@ -302,6 +447,9 @@ class CounterAggregator(MetricAggregator):
   def combine(self, x, y):
     return int(x) + int(y)
 
+  def combine_many(self, updates):
+    return sum(int(x) for x in updates)
+
   def result(self, x):
     return int(x)
 
@@ -317,5 +465,17 @@ class DistributionAggregator(MetricAggregator):
   def combine(self, x, y):
     return x.combine(y)
 
+  def combine_many(self, updates):
+    updates = list(updates)
+    if not updates:
+      return self.zero()
+    # Reducing each field over the whole batch avoids allocating an
+    # intermediate DistributionData per pairwise combine.
+    return DistributionData(
+        sum(x.sum for x in updates),
+        sum(x.count for x in updates),
+        min(x.min for x in updates),
+        max(x.max for x in updates))
+
   def result(self, x):
     return DistributionResult(x.get_cumulative())
@@ -108,6 +108,20 @@ class TestDistributionCell(unittest.TestCase):
     self.assertEqual(d.get_cumulative(),
                      DistributionData(912, 3, 2, 900))
 
+  def test_update_many(self):
+    d = DistributionCell()
+    d.update_many([])
+    self.assertEqual(d.get_cumulative(),
+                     DistributionData(0, 0, None, None))
+
+    d.update_many([1, 5, 3])
+    self.assertEqual(d.get_cumulative(),
+                     DistributionData(9, 3, 1, 5))
+
+    d.update_many([7.5, 2.5])
+    self.assertEqual(d.get_cumulative(),
+                     DistributionData(18, 5, 1, 7))
+
   def test_integer_only(self):
     d = DistributionCell()
     d.update(3.1)
@@ -62,12 +62,17 @@ class MetricName(object):
 
 class Metric(object):
   """Base interface of a metric object."""
-  pass
+  # Declared empty so that these interfaces never force a per-instance
+  # __dict__ on a subclass that declares __slots__ itself. Subclasses
+  # without __slots__ keep their __dict__ as usual.
+  __slots__ = ()
 
 
 class Counter(Metric):
   """Counter metric interface. Allows a count to be incremented/decremented
   during pipeline execution."""
+  __slots__ = ()
+
   def inc(self, n=1):
     raise NotImplementedError
 
@@ -78,5 +83,7 @@ class Counter(Metric):
 class Distribution(Metric):
   """Distribution Metric interface. Allows statistics about the
     distribution of a variable to be collected during pipeline execution."""
+  __slots__ = ()
+
   def update(self, value):
     raise NotImplementedError
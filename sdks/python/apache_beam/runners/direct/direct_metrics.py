@@ -105,8 +105,6 @@ class DirectMetric(object):
     return self.aggregator.result(self.finished_committed)
 
   def extract_latest_attempted(self):
-    res = self.finished_attempted
-    for _, u in self.inflight_attempted.items():
-      res = self.aggregator.combine(res, u)
-
+    res = self.aggregator.combine_many(
+        [self.finished_attempted] + list(self.inflight_attempted.values()))
     return self.aggregator.result(res)